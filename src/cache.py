@@ -0,0 +1,151 @@
+from collections import OrderedDict
+from constants import RESULT_CACHE_SIZE, SELECTION_CACHE_SIZE
+
+
+class LRUCache:
+    def __init__(self, capacity: int, weigher=None):
+        """
+        Initializes an LRUCache object.
+
+        Each entry records the zones it was computed from and the value range it filtered each column on, so
+        that it can be invalidated when ingestion rewrites any of those zones.
+
+        Args:
+            capacity (int): The maximum total weight of the cached entries. 0 disables caching.
+            weigher (callable, optional): Returns the weight of a value. Defaults to a weight of 1 per entry.
+        """
+        self.capacity = capacity
+        self.weigher = weigher or (lambda value: 1)
+        self.weight = 0
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        """
+        Returns a cached value and marks it as most recently used.
+
+        Args:
+            key: The cache key.
+
+        Returns:
+            The cached value, or None if the key is not cached.
+        """
+        if key not in self.entries:
+            return None
+
+        self.entries.move_to_end(key)
+        return self.entries[key]['value']
+
+    def put(self, key, value, zones: dict, windows: dict):
+        """
+        Caches a value, evicting the least recently used entries until it fits.
+
+        Args:
+            key: The cache key.
+            value: The value to cache.
+            zones (dict): The zone counts read for each (store name, column name) while computing the value.
+            windows (dict): The (start, end) value range filtered on for each column.
+        """
+        # every entry weighs at least 1 so that empty values still count towards the capacity
+        weight = max(1, self.weigher(value))
+        if self.capacity <= 0 or weight > self.capacity:
+            return
+
+        self.remove(key)
+        while self.entries and self.weight + weight > self.capacity:
+            self.remove(next(iter(self.entries)))
+
+        self.entries[key] = {'value': value, 'weight': weight,
+                             'zones': zones, 'windows': windows}
+        self.weight += weight
+
+    def remove(self, key):
+        """
+        Removes an entry if it is cached.
+
+        Args:
+            key: The cache key.
+        """
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.weight -= entry['weight']
+
+    def invalidate(self, store_name: str, column_name: str, zone_maps: list):
+        """
+        Removes the entries affected by a change to the given zones of a column.
+
+        An entry is affected if it read one of the zones, or if the new value range of one of the zones overlaps
+        the range the entry filtered the column on.
+
+        Args:
+            store_name (str): The name of the column store or projection holding the zones.
+            column_name (str): The column name.
+            zone_maps (list): The ZoneMap objects of the zones before and after the change.
+        """
+        zone_counts = {zone_map.get_zone_count() for zone_map in zone_maps}
+        value_ranges = [zone_map.get_value_range() for zone_map in zone_maps]
+
+        for key, entry in list(self.entries.items()):
+            if zone_counts & entry['zones'].get((store_name, column_name), set()):
+                self.remove(key)
+                continue
+
+            window = entry['windows'].get(column_name)
+            if window is None:
+                continue
+
+            start, end = window
+            if any(min_value is not None and min_value <= end and start <= max_value
+                   for min_value, max_value in value_ranges):
+                self.remove(key)
+
+    def __contains__(self, key):
+        # unlike get, checking for a key does not mark it as recently used
+        return key in self.entries
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        self.entries.clear()
+        self.weight = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class QueryCache:
+    def __init__(self, result_capacity: int = RESULT_CACHE_SIZE, selection_capacity: int = SELECTION_CACHE_SIZE):
+        """
+        Initializes a QueryCache object.
+
+        The first level maps a (month window, town, statistic) query to its result. The second level maps a
+        (store name, column name, range) key to the indexes selected by the first stage of a query, so that queries
+        repeating the month window skip that stage.
+
+        Args:
+            result_capacity (int, optional): The maximum number of cached results. Defaults to RESULT_CACHE_SIZE.
+            selection_capacity (int, optional): The maximum number of indexes held by cached selections.
+                Defaults to SELECTION_CACHE_SIZE.
+        """
+        self.results = LRUCache(result_capacity)
+        self.selections = LRUCache(
+            selection_capacity, weigher=lambda value: max(1, len(value[0])))
+
+    def invalidate(self, store_name: str, column_name: str, zone_maps: list):
+        """
+        Removes the results and selections affected by a change to the given zones of a column.
+
+        Args:
+            store_name (str): The name of the column store or projection holding the zones.
+            column_name (str): The column name.
+            zone_maps (list): The ZoneMap objects of the zones before and after the change.
+        """
+        self.results.invalidate(store_name, column_name, zone_maps)
+        self.selections.invalidate(store_name, column_name, zone_maps)
+
+    def clear(self):
+        """
+        Removes all cached results and selections.
+        """
+        self.results.clear()
+        self.selections.clear()
@@ -4,6 +4,21 @@ DISK_FOLDER = 'processed'
 BUFFER_FOLDER = 'temp'
 OUTPUT_FOLDER = 'output'
 OUTPUT_HEADERS = ['Year', 'Month', 'Town', 'Category', 'Value']
+RESULT_CACHE_SIZE = 256  # number of cached query results
+SELECTION_CACHE_SIZE = 1000000  # number of indexes held by cached month selections
+ZONE_SIZE_CANDIDATES = [250, 500, 1000, 2500, 5000, 10000, 25000]
+TUNER_WORKLOAD_SIZE = 20  # number of sampled queries timed per candidate zone size
+TUNER_REPEATS = 3
+PREFETCH_DEPTH = 4  # number of chunk files read ahead of the one being processed
+PREFETCH_WORKERS = 2
+
+PROJECTIONS = [['town', 'month']]  # sort columns of the projections built at ingest
+ROW_ID_COLUMN = 'row_id'
+
+# value types used for zone maps and filters, columns not listed are compared as strings
+COLUMN_TYPES = {
+    'town': int, 'floor_area_sqm': float, 'resale_price': float, 'lease_commence_date': int, ROW_ID_COLUMN: int
+}
 
 STATISTIC_TYPE = {
     1: 'Minimum Area', 2: 'Average Area', 3: 'Standard Deviation of Area', 4: 'Minimum Price', 5: 'Average Price', 6: 'Standard Deviation of Price'
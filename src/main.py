@@ -3,9 +3,15 @@ import csv
 import statistics
 import time
 from constants import *
+from cache import QueryCache
+from prefetch import ZonePrefetcher, read_chunk
 from typing import Dict, List
 from enum import Enum
 import shutil
+import itertools
+import heapq
+import bisect
+import functools
 
 
 class ColumnsOfInterest(Enum):
@@ -13,6 +19,9 @@ class ColumnsOfInterest(Enum):
     MONTH = 'month'
     FLOOR_AREA_SQM = 'floor_area_sqm'
     RESALE_PRICE = 'resale_price'
+    FLAT_TYPE = 'flat_type'
+    STOREY_RANGE = 'storey_range'
+    LEASE_COMMENCE_DATE = 'lease_commence_date'
 
 
 class ZoneMap:
@@ -37,6 +46,9 @@ class ZoneMap:
         elif column_name == 'town':
             self.data['min_town'] = float("inf")
             self.data['max_town'] = -1
+        else:
+            self.data[f'min_{column_name}'] = None
+            self.data[f'max_{column_name}'] = None
 
     def set_min_idx(self, min_idx):
         """
@@ -70,11 +82,30 @@ class ZoneMap:
             self.data['min_month'] = min(min_month, value)
             self.data['max_month'] = max(max_month, value)
         elif self.column_name == 'town':
+            value = parse_column_value(self.column_name, value)
             min_town = self.data['min_town']
             max_town = self.data['max_town']
 
             self.data['min_town'] = min(min_town, value)
             self.data['max_town'] = max(max_town, value)
+        else:
+            value = parse_column_value(self.column_name, value)
+            min_value = self.data[f'min_{self.column_name}']
+            max_value = self.data[f'max_{self.column_name}']
+
+            self.data[f'min_{self.column_name}'] = value if min_value is None else min(
+                min_value, value)
+            self.data[f'max_{self.column_name}'] = value if max_value is None else max(
+                max_value, value)
+
+    def get_value_range(self):
+        """
+        Returns the minimum and maximum column values within the zone.
+
+        Returns:
+            tuple: The minimum and maximum values.
+        """
+        return self.data[f'min_{self.column_name}'], self.data[f'max_{self.column_name}']
 
     def get_zone_map(self):
         """
@@ -95,8 +126,26 @@ class ZoneMap:
         return self.zone_count
 
 
+@functools.total_ordering
+class ReversedKey:
+    def __init__(self, value):
+        """
+        Initializes a ReversedKey object, which orders in the reverse order of its value.
+
+        Args:
+            value: The wrapped value.
+        """
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
 class ColumnStore:
-    def __init__(self, csv_file_path: str, disk_folder: str, columns_of_interest: List[ColumnsOfInterest], max_file_lines=MAX_FILE_LINES):
+    def __init__(self, csv_file_path: str, disk_folder: str, columns_of_interest: List[ColumnsOfInterest], max_file_lines=MAX_FILE_LINES, zone_sizes: Dict[str, int] = None, projections: List[List[str]] = None, name: str = 'base'):
         """
         Initializes a ColumnStore object.
 
@@ -105,12 +154,24 @@ class ColumnStore:
             disk_folder (str): The path to the folder where the chunk files will be stored.
             columns_of_interest (List[ColumnsOfInterest]): A list of columns of interest.
             max_file_lines (int, optional): The maximum number of lines per chunk file. Defaults to MAX_FILE_LINES.
+            zone_sizes (Dict[str, int], optional): The number of lines per chunk file of individual columns,
+                overriding max_file_lines. Defaults to None.
+            projections (List[List[str]], optional): The sort columns of the projections built by process_csv.
+                Defaults to None.
+            name (str, optional): The name of the column store. Defaults to 'base'.
         """
         self.csv_file_path = csv_file_path
         self.disk_folder = disk_folder
         self.columns_of_interest = columns_of_interest
         self.max_file_lines = max_file_lines
+        self.zone_sizes: Dict[str, int] = dict(zone_sizes or {})
         self.zone_maps: Dict[str, List[ZoneMap]] = {}
+        self.row_count = 0
+        self.query_cache = QueryCache()
+        self.name = name
+        self.projection_sort_columns = [list(sort_columns)
+                                        for sort_columns in projections or []]
+        self.projections: Dict[str, ColumnStore] = {}
 
         create_directory_if_not_exists(self.disk_folder)
 
@@ -123,57 +184,351 @@ class ColumnStore:
         Processes the CSV file and creates chunk files and zone maps.
         """
         idx = 0  # line index
-        zone_count = 0
         opened_files = {}
+        old_zone_maps = {}
+
+        for column_name in self.columns_of_interest:
+            old_zone_maps[column_name] = self.zone_maps[column_name]
+            self.zone_maps[column_name] = []
 
         with open(self.csv_file_path, 'r', newline='', encoding='utf-8') as csv_file:
             reader = csv.DictReader(csv_file)
-            for _, row in enumerate(reader, start=1):
-                # new zone -> create file and update min index
-                if idx % self.max_file_lines == 0:
-                    for col_name in self.columns_of_interest:
-                        opened_files[col_name] = open(os.path.join(
-                            self.disk_folder, f"{col_name}_chunk_{zone_count}.txt"), 'w')
-                        self.zone_maps[col_name].append(
-                            ZoneMap(col_name, zone_count))
-                        self.zone_maps[col_name][-1].set_min_idx(idx)
-                    zone_count += 1
-
-                mapped_value = 0
+            for row in reader:
+                # skip the row if the town is not in the mapping
+                if row['town'] not in ALL_TOWNS_MAPPING:
+                    continue
+
                 for column_name in self.columns_of_interest:
                     value = row[column_name]
                     if column_name == 'town':
-                        value = ALL_TOWNS_MAPPING[value] if value in ALL_TOWNS_MAPPING else -1
-                        if value == -1:
-                            # flag to skip the rest of the columns
-                            mapped_value = -1
-                            break
-
-                        self.zone_maps[column_name][-1].update_zone_map(
-                            value)
-                    elif column_name == 'month':
-                        self.zone_maps[column_name][-1].update_zone_map(
-                            value)
-
-                    file = opened_files[column_name]
-                    file.write(f"{value}\n")
-
-                # skip the rest of the columns if the town is not in the mapping
-                if mapped_value == -1:
-                    continue
-
-                # end of zone -> close the current files and update max index
-                if idx % self.max_file_lines == self.max_file_lines - 1:
-                    for col_name in self.columns_of_interest:
-                        opened_files[col_name].close()
-                        self.zone_maps[col_name][-1].set_max_idx(idx)
+                        value = ALL_TOWNS_MAPPING[value]
+                    self.write_value(column_name, idx, value, opened_files)
 
                 idx += 1
 
         # close the last set of files and update max index
-        for col_name in self.columns_of_interest:
-            opened_files[col_name].close()
-            self.zone_maps[col_name][-1].set_max_idx(idx)
+        for column_name in self.columns_of_interest:
+            self.close_zone(column_name, idx, opened_files)
+            self.query_cache.invalidate(
+                self.name, column_name, old_zone_maps[column_name] + self.zone_maps[column_name])
+
+        self.row_count = idx
+
+        for sort_columns in self.projection_sort_columns:
+            self.build_projection(sort_columns)
+
+    def add_column(self, column_name: str, zone_size: int = None):
+        """
+        Materializes an additional CSV column into the existing column store.
+
+        Makes a single streaming pass over the CSV that extracts only the new column, and builds its chunk files
+        and zone maps aligned to the row indexes of the existing columns. Existing columns are not rewritten.
+
+        Args:
+            column_name (str): The name of the CSV column to add.
+            zone_size (int, optional): The number of lines per chunk file of the column. Defaults to max_file_lines.
+        """
+        if column_name in self.columns_of_interest:
+            print(f"Column {column_name} is already in the column store.")
+            return
+
+        if zone_size is not None:
+            self.zone_sizes[column_name] = zone_size
+
+        idx = 0  # line index
+        opened_files = {}
+        self.zone_maps[column_name] = []
+
+        try:
+            with open(self.csv_file_path, 'r', newline='', encoding='utf-8') as csv_file:
+                reader = csv.DictReader(csv_file)
+                if column_name not in reader.fieldnames:
+                    raise ValueError(
+                        f"Column {column_name} not found in {self.csv_file_path}")
+
+                for row in reader:
+                    # skip the same rows as process_csv so that the row indexes line up
+                    if row['town'] not in ALL_TOWNS_MAPPING:
+                        continue
+
+                    self.write_value(
+                        column_name, idx, row[column_name], opened_files)
+                    idx += 1
+
+            self.close_zone(column_name, idx, opened_files)
+
+            if idx != self.row_count:
+                raise ValueError(
+                    f"{self.csv_file_path} has {idx} rows but the column store has {self.row_count}")
+        except Exception:
+            # remove the half-added column so that the store is left as it was
+            for file in opened_files.values():
+                file.close()
+            self.discard_column(column_name)
+            raise
+
+        self.columns_of_interest.append(column_name)
+        self.query_cache.invalidate(
+            self.name, column_name, self.zone_maps[column_name])
+
+        # keep the projections complete so that the planner can still route queries to them
+        values = self.read_column(column_name) if self.projections else []
+        for projection in self.projections.values():
+            row_ids = projection.read_column(ROW_ID_COLUMN)
+            projection.write_column(column_name, [values[int(row_id)] for row_id in row_ids],
+                                    self.zone_sizes.get(column_name))
+            projection.columns_of_interest.append(column_name)
+
+    def discard_column(self, column_name: str):
+        """
+        Removes the chunk files, zone maps and zone size of a column that is not in the columns of interest.
+
+        Args:
+            column_name (str): The column name.
+        """
+        for zone_map in self.zone_maps.pop(column_name, []):
+            chunk_path = self.get_chunk_path(
+                column_name, zone_map.get_zone_count())
+            if os.path.exists(chunk_path):
+                os.remove(chunk_path)
+        self.zone_sizes.pop(column_name, None)
+
+    def set_zone_size(self, column_name: str, zone_size: int):
+        """
+        Re-splits the chunk files of a column into zones of a different size.
+
+        The values are read back from the existing chunk files, so the CSV is not processed again. The column is
+        re-split in the projections as well, so that every layout the planner can pick uses the same zone size.
+
+        Args:
+            column_name (str): The column name.
+            zone_size (int): The new number of lines per chunk file of the column.
+        """
+        self.write_column(column_name, self.read_column(column_name), zone_size)
+
+        for projection in self.projections.values():
+            if column_name in projection.zone_maps:
+                projection.set_zone_size(column_name, zone_size)
+
+    def read_column(self, column_name: str) -> list:
+        """
+        Reads all values of a column from its chunk files.
+
+        Args:
+            column_name (str): The column name.
+
+        Returns:
+            list: The raw values of the column, in row index order.
+        """
+        values = []
+        for zone_map in self.zone_maps[column_name]:
+            with open(self.get_chunk_path(column_name, zone_map.get_zone_count()), 'r', encoding='utf-8') as file:
+                values += [line.rstrip('\n') for line in file]
+        return values
+
+    def write_column(self, column_name: str, values: list, zone_size: int = None):
+        """
+        Rewrites the chunk files and zone maps of a column from a list of values.
+
+        Args:
+            column_name (str): The column name.
+            values (list): The values of the column, in row index order.
+            zone_size (int, optional): The number of lines per chunk file of the column. Defaults to the current
+                zone size of the column.
+        """
+        old_zone_maps = self.zone_maps.get(column_name, [])
+        if zone_size is not None:
+            self.zone_sizes[column_name] = zone_size
+
+        self.zone_maps[column_name] = []
+        opened_files = {}
+        for idx, value in enumerate(values):
+            self.write_value(column_name, idx, value, opened_files)
+        self.close_zone(column_name, len(values), opened_files)
+
+        # remove the chunk files left over from the old zones
+        for zone_count in range(len(self.zone_maps[column_name]), len(old_zone_maps)):
+            os.remove(self.get_chunk_path(column_name, zone_count))
+
+        self.query_cache.invalidate(
+            self.name, column_name, old_zone_maps + self.zone_maps[column_name])
+
+    def build_projection(self, sort_columns: List[str]):
+        """
+        Builds a copy of the columns of interest sorted by the given columns, in the style of a C-Store projection.
+
+        The projection has its own chunk files and zone maps, plus a row_id column holding the row index of each
+        row in this column store. It shares the query cache of this column store.
+
+        Args:
+            sort_columns (List[str]): The columns to sort by, e.g. ['town', 'month'].
+
+        Returns:
+            ColumnStore: The projection.
+        """
+        name = '_'.join(sort_columns)
+        if list(sort_columns) not in self.projection_sort_columns:
+            self.projection_sort_columns.append(list(sort_columns))
+
+        projection = self.projections.get(name)
+        if projection is None:
+            projection = ColumnStore(self.csv_file_path, os.path.join(self.disk_folder, f"projection_{name}"), [],
+                                     self.max_file_lines, self.zone_sizes, name=name)
+            projection.query_cache = self.query_cache
+
+        values = {column_name: self.read_column(column_name)
+                  for column_name in self.columns_of_interest}
+        keys = [[parse_column_value(column_name, value) for value in values[column_name]]
+                for column_name in sort_columns]
+        # sorted is stable, so rows with equal sort keys keep their original order
+        row_ids = sorted(range(self.row_count),
+                         key=lambda row_id: tuple(key[row_id] for key in keys))
+
+        for column_name in self.columns_of_interest:
+            projection.write_column(
+                column_name, [values[column_name][row_id] for row_id in row_ids])
+        projection.write_column(ROW_ID_COLUMN, row_ids)
+
+        projection.columns_of_interest = self.columns_of_interest + \
+            [ROW_ID_COLUMN]
+        projection.row_count = self.row_count
+        self.projections[name] = projection
+        return projection
+
+    def plan_query(self, predicates: Dict[str, tuple], column_name: str):
+        """
+        Picks the column store or projection, and the order of the filter stages, that read the fewest rows.
+
+        A first stage whose selection is in the query cache costs nothing, so queries over a cached month window
+        keep reusing it rather than moving to a projection.
+
+        Args:
+            predicates (Dict[str, tuple]): The (start, end) range filtered on for each column.
+            column_name (str): The column name of interest.
+
+        Returns:
+            tuple: The chosen ColumnStore and the predicate columns in the order they should be filtered.
+        """
+        best_cost, best_store, best_order = None, None, None
+        for store in [self] + list(self.projections.values()):
+            if any(column not in store.zone_maps for column in [*predicates, column_name]):
+                continue
+
+            for order in itertools.permutations(predicates):
+                first_cached = (store.name, order[0], predicates[order[0]]) in \
+                    self.query_cache.selections
+                cost = store.estimate_rows_read(
+                    [(column, *predicates[column]) for column in order], column_name, first_cached)
+                if best_cost is None or cost < best_cost:
+                    best_cost, best_store, best_order = cost, store, list(order)
+
+        return best_store, best_order
+
+    def estimate_rows_read(self, filters: List[tuple], column_name: str, first_cached: bool = False) -> int:
+        """
+        Estimates the number of rows a query reads from the chunk files, using only the zone maps.
+
+        The first filter reads every zone whose values overlap its range. Every later stage, including the column
+        of interest, only reads the zones whose index range overlaps the zones kept by the stages before it.
+
+        Args:
+            filters (List[tuple]): The (column name, start, end) of each filter stage, in order.
+            column_name (str): The column name of interest.
+            first_cached (bool, optional): Whether the selection of the first filter is served from the query cache,
+                in which case its zones are not read. Defaults to False.
+
+        Returns:
+            int: The total size of the zones read.
+        """
+        rows_read = 0
+        spans = [(0, self.row_count - 1)]
+        for stage, (filter_column, start, end) in enumerate(filters + [(column_name, None, None)]):
+            new_spans = []
+            for zone_map in self.zone_maps[filter_column]:
+                min_value, max_value = zone_map.get_value_range()
+                if start is not None and not (min_value <= end and start <= max_value):
+                    continue
+
+                min_idx, max_idx = zone_map.get_zone_map()['min_idx'], zone_map.get_zone_map()[
+                    'max_idx']
+                overlaps = [(max(min_idx, span_start), min(max_idx, span_end)) for span_start, span_end in spans
+                            if min_idx <= span_end and span_start <= max_idx]
+                if overlaps:
+                    if stage > 0 or not first_cached:
+                        rows_read += max_idx - min_idx + 1
+                    new_spans += overlaps
+            spans = new_spans
+
+        return rows_read
+
+    def get_zone_size(self, column_name: str) -> int:
+        """
+        Returns the number of lines per chunk file of a column.
+
+        Args:
+            column_name (str): The column name.
+
+        Returns:
+            int: The zone size of the column.
+        """
+        return self.zone_sizes.get(column_name, self.max_file_lines)
+
+    def write_value(self, column_name: str, idx: int, value, opened_files: dict):
+        """
+        Writes a value to the current chunk file of a column, opening a new zone every zone size rows.
+
+        Args:
+            column_name (str): The column name.
+            idx (int): The row index of the value.
+            value: The value to write.
+            opened_files (dict): The currently opened chunk file of each column.
+        """
+        zone_size = self.get_zone_size(column_name)
+
+        # new zone -> create file and update min index
+        if idx % zone_size == 0:
+            zone_count = len(self.zone_maps[column_name])
+            opened_files[column_name] = open(self.get_chunk_path(
+                column_name, zone_count), 'w', encoding='utf-8')
+            self.zone_maps[column_name].append(
+                ZoneMap(column_name, zone_count))
+            self.zone_maps[column_name][-1].set_min_idx(idx)
+
+        self.zone_maps[column_name][-1].update_zone_map(value)
+        opened_files[column_name].write(f"{value}\n")
+
+        # end of zone -> close the current file and update max index
+        if idx % zone_size == zone_size - 1:
+            self.close_zone(column_name, idx + 1, opened_files)
+
+    def close_zone(self, column_name: str, idx: int, opened_files: dict):
+        """
+        Closes the current chunk file of a column and updates the max index of its zone.
+
+        Args:
+            column_name (str): The column name.
+            idx (int): The row index following the last row of the zone.
+            opened_files (dict): The currently opened chunk file of each column.
+        """
+        file = opened_files.get(column_name)
+        if file is None or file.closed:
+            return
+
+        file.close()
+        self.zone_maps[column_name][-1].set_max_idx(idx - 1)
+
+    def get_chunk_path(self, column_name: str, zone_count: int) -> str:
+        """
+        Returns the path of a chunk file.
+
+        Args:
+            column_name (str): The column name.
+            zone_count (int): The zone count.
+
+        Returns:
+            str: The path of the chunk file.
+        """
+        return os.path.join(self.disk_folder, f"{column_name}_chunk_{zone_count}.txt")
 
     def get_zone_maps(self) -> Dict[str, List[ZoneMap]]:
         """
@@ -186,7 +541,7 @@ class ColumnStore:
 
 
 class QueryProcessor:
-    def __init__(self, year: int, month: int, town: int, column_store: ColumnStore, buffer_folder=BUFFER_FOLDER, max_file_lines=MAX_FILE_LINES):
+    def __init__(self, year: int, month: int, town: int, column_store: ColumnStore, buffer_folder=BUFFER_FOLDER, max_file_lines=MAX_FILE_LINES, prefetch_depth=PREFETCH_DEPTH):
         """
         Initializes a QueryProcessor object.
 
@@ -195,6 +550,8 @@ class QueryProcessor:
             month (int): The month value.
             town (int): The town value.
             column_store (ColumnStore): The column store object.
+            prefetch_depth (int, optional): The number of split files read ahead of the one being processed.
+                Defaults to PREFETCH_DEPTH.
         """
         self.year = year
         self.month = month
@@ -206,6 +563,12 @@ class QueryProcessor:
         self.lines_processed = 0
         self.data = []
         self.max_file_lines = max_file_lines
+        self.prefetcher = ZonePrefetcher(prefetch_depth)
+        self.base_store = column_store  # the planner may route the query to one of its projections
+        self.query_cache = column_store.query_cache
+        self.selected_indexes = []  # indexes written by the current stage
+        self.selections = {}  # indexes of a stage served from the cache
+        self.zones_read: Dict[tuple, set] = {}
         create_directory_if_not_exists(self.buffer_folder)
 
     def process_year_and_month(self, column_name: ColumnsOfInterest = 'month'):
@@ -215,144 +578,402 @@ class QueryProcessor:
         Args:
             column_name (ColumnsOfInterest, optional): The column name of interest. Defaults to 'month'.
         """
-        print("\n" + "=" * 60)
-        print("Processing year and month...")
-        zone_maps = self.column_store.get_zone_maps()
-        zone_map_arr = zone_maps[column_name]
-        start_value = f"{self.year}-{self.month:02}"
-        end_value = f"{self.year}-{(self.month + 2) % 12:02}"
-        print(start_value, end_value)
-
-        # Iterate through ZoneMaps for the specified column
-        for zone_map in zone_map_arr:
-            zone_data = zone_map.get_zone_map()
-            zone_count = zone_map.get_zone_count()
-
-            # Check if the specified year and month fall within the range
-            if zone_data['min_month'] <= end_value and start_value <= zone_data['max_month']:
-                print(
-                    f"Found the zone containing the year and month: {zone_count}")
-                # Process the split files within the zone
-                self.process_split_files(
-                    column_name, zone_count, start_value, end_value)
+        start_value, end_value = self.get_month_window()
+        self.process_scan(column_name, start_value, end_value)
 
-        # reset
-        self.reset_globals()
-
-    def process_towns(self, column_name: ColumnsOfInterest = 'town'):
+    def process_towns(self, column_name: ColumnsOfInterest = 'town', source_column: ColumnsOfInterest = 'month'):
         """
         Processes the towns data.
 
         Args:
             column_name (ColumnsOfInterest, optional): The column name of interest. Defaults to 'town'.
+            source_column (ColumnsOfInterest, optional): The column of the previous stage. Defaults to 'month'.
+        """
+        self.process_filter(column_name, self.town, self.town, source_column)
+
+    def process_scan(self, column_name: ColumnsOfInterest, start, end):
+        """
+        Selects the indexes of the rows whose value falls within a range, as the first stage of a query.
+
+        Args:
+            column_name (ColumnsOfInterest): The column name to filter on.
+            start: The inclusive lower bound of the column value.
+            end: The inclusive upper bound of the column value.
         """
         print("\n" + "=" * 60)
-        print("Processing towns...")
+        print(f"Processing {column_name}...")
+        print(start, end)
 
-        # Read the indexes from the month's temp folder
-        indexes = []
-        start, end = float('inf'), float('-inf')
-        for i in range(self.num_buffer_folders + 1):
-            month_temp_file_path = os.path.join(
-                self.buffer_folder, f"month_chunk_{i}.txt")
+        # Reuse the selection of a previous query over the same range
+        selection_cache = self.query_cache.selections
+        key = (self.column_store.name, column_name, (start, end))
+        selection = selection_cache.get(key)
+        if selection is not None:
+            print("Found the selected indexes in the cache")
+            self.selections[column_name], zone_counts = selection
+            self.zones_read.setdefault(
+                (self.column_store.name, column_name), set()).update(zone_counts)
+            return
+
+        # Find the zones whose values overlap the range
+        zone_counts = []
+        for zone_map in self.column_store.get_zone_maps()[column_name]:
+            min_value, max_value = zone_map.get_value_range()
+            if min_value <= end and start <= max_value:
+                zone_counts.append(zone_map.get_zone_count())
 
-            if not os.path.exists(month_temp_file_path):
-                print(f"Error: {month_temp_file_path} not found.")
-                continue
+        # Process the split files within the zones as they are read
+        for zone_count, lines in self.read_zones(column_name, zone_counts):
+            print(f"Found the zone containing the values: {zone_count}")
+            self.process_split_files(
+                column_name, zone_count, start, end, lines=lines)
 
-            with open(month_temp_file_path, 'r', encoding='utf-8') as month_temp_file:
-                indexes += [int(line.split(" ")[1])
-                            for line in month_temp_file]
-                start = min(start, indexes[0])
-                end = max(end, indexes[-1])
+        zone_counts = set(self.zones_read.get(
+            (self.column_store.name, column_name), set()))
+        selection_cache.put(key, (self.selected_indexes, zone_counts),
+                            {(self.column_store.name, column_name): zone_counts}, {column_name: (start, end)})
 
-        print(f"Length of indexes from month:", len(indexes))
-        print(start, end)
+        # reset
+        self.reset_globals()
 
-        # Reset the buffer folder count
-        self.num_buffer_folders = 0
+    def process_filter(self, column_name: ColumnsOfInterest, start, end, source_column: ColumnsOfInterest = 'town'):
+        """
+        Filters the indexes selected by a previous stage on another column, e.g. one added with ColumnStore.add_column.
 
-        # Find the zone containing the indexes
+        Args:
+            column_name (ColumnsOfInterest): The column name to filter on.
+            start: The inclusive lower bound of the column value.
+            end: The inclusive upper bound of the column value.
+            source_column (ColumnsOfInterest, optional): The column of the previous stage. Defaults to 'town'.
+        """
+        print("\n" + "=" * 60)
+        print(f"Processing {column_name}...")
+
+        # Read the indexes from the previous stage's temp folder
+        indexes, first, last = self.read_buffer_indexes(source_column)
+        print(f"Length of indexes from {source_column}:", len(indexes))
+        print(first, last)
+
+        # Find the zones containing both the indexes and the values
+        zone_indexes = {}
         for zone_map in self.column_store.get_zone_maps()[column_name]:
             min_idx, max_idx = \
                 zone_map.get_zone_map()['min_idx'], zone_map.get_zone_map()[
                     'max_idx']
-            if min_idx <= end and start <= max_idx:
-                print(
-                    f"Found the zone containing the indexes: {zone_map.get_zone_count()}")
-                # Process the split files within the target zone
-                zone_indexes = self.get_zone_indexes(indexes, min_idx, max_idx)
-                # This zone has no indexes matched
-                if len(zone_indexes) == 0:
-                    continue
-                print("Range of indexes:", min(
-                    zone_indexes), max(zone_indexes))
-
-                self.process_split_files(column_name, zone_map.get_zone_count(), str(
-                    self.town), str(self.town), zone_indexes)
+            min_value, max_value = zone_map.get_value_range()
+            if min_idx <= last and first <= max_idx and min_value <= end and start <= max_value:
+                indexes_in_zone = self.get_zone_indexes(
+                    indexes, min_idx, max_idx)
+                if len(indexes_in_zone) > 0:
+                    zone_indexes[zone_map.get_zone_count()] = indexes_in_zone
+
+        # Process the split files within the zones as they are read
+        for zone_count, lines in self.read_zones(column_name, list(zone_indexes)):
+            print(f"Found the zone containing the indexes: {zone_count}")
+            self.process_split_files(
+                column_name, zone_count, start, end, zone_indexes[zone_count], lines=lines)
 
         # reset
         self.reset_globals()
 
-    def process_query(self, column_name: ColumnsOfInterest, interested_stat: int):
+    def process_query(self, column_name: ColumnsOfInterest, interested_stat: int, source_column: ColumnsOfInterest = 'town'):
         """
         Processes the query.
 
         Args:
             column_name (ColumnsOfInterest): The column name of interest.
+            interested_stat (int): The statistic to calculate.
+            source_column (ColumnsOfInterest, optional): The column of the previous stage. Defaults to 'town'.
         """
         print("\n" + "=" * 60)
         print(f"Processing {column_name}...")
 
-        # Read the indexes from the town's temp folder
-        indexes = []
-        start, end = float('inf'), float('-inf')
-        for i in range(self.num_buffer_folders + 1):
-            town_temp_file_path = os.path.join(
-                self.buffer_folder, f"town_chunk_{i}.txt")
+        # Read the indexes from the previous stage's temp folder
+        indexes, start, end = self.read_buffer_indexes(source_column)
+        print(f"Length of indexes from {source_column}:", len(indexes))
+        print(start, end)
 
-            if not os.path.exists(town_temp_file_path):
-                print(f"Error: {town_temp_file_path} not found.")
-                continue
+        # Find the zones containing the indexes
+        zone_indexes = {}
+        for zone_map in self.column_store.get_zone_maps()[column_name]:
+            min_idx, max_idx = \
+                zone_map.get_zone_map()['min_idx'], zone_map.get_zone_map()[
+                    'max_idx']
+            if min_idx <= end and start <= max_idx:
+                indexes_in_zone = self.get_zone_indexes(
+                    indexes, min_idx, max_idx)
+                if len(indexes_in_zone) > 0:
+                    zone_indexes[zone_map.get_zone_count()] = indexes_in_zone
+
+        # Process the split files within the zones as they are read
+        for zone_count, lines in self.read_zones(column_name, list(zone_indexes)):
+            print(f"Found the zone containing the indexes: {zone_count}")
+            print("Range of indexes:", min(
+                zone_indexes[zone_count]), max(zone_indexes[zone_count]))
+            self.process_split_files(
+                column_name, zone_count, None, None, zone_indexes[zone_count], True, lines)
 
-            with open(town_temp_file_path, 'r', encoding='utf-8') as month_temp_file:
-                indexes += [int(line.split(" ")[1])
-                            for line in month_temp_file]
-                start = min(start, indexes[0])
-                end = max(end, indexes[-1])
+        # self.debug_output_data()
+
+        output = self.calc_stat(interested_stat)
 
-        print("Length of indexes from town:", len(indexes))
+        # reset data buffer
+        self.data = []
+        return output
+
+    def process_top_k(self, column_name: ColumnsOfInterest, k: int, source_column: ColumnsOfInterest = 'town', descending: bool = True):
+        """
+        Finds the k selected rows with the largest or smallest values of a column, without materializing every value.
+
+        Zones are visited from the one whose zone map bound is the most promising. Each zone keeps at most k values
+        in a bounded heap, and the zones whose bound cannot beat the current k-th value are skipped.
+
+        Args:
+            column_name (ColumnsOfInterest): The column name to order by.
+            k (int): The number of rows to return.
+            source_column (ColumnsOfInterest, optional): The column of the previous stage. Defaults to 'town'.
+            descending (bool, optional): Orders from the largest value if True. Defaults to True.
+
+        Returns:
+            list: The (value, index) pairs in order, where index is the row index in the base column store, even
+                when the query ran on a projection, and can be passed to fetch_columns.
+        """
+        print("\n" + "=" * 60)
+        print(f"Processing top {k} of {column_name}...")
+
+        # Read the indexes from the previous stage's temp folder
+        indexes, start, end = self.read_buffer_indexes(source_column)
+        print(f"Length of indexes from {source_column}:", len(indexes))
         print(start, end)
 
-        # Reset the buffer folder count
-        self.num_buffer_folders = 0
+        # values are wrapped in a reversed order when ascending so that the heap always keeps the largest keys
+        make_key = (lambda value: value) if descending else ReversedKey
 
-        # Find the zone containing the indexes
+        # Find the zones containing the indexes, from the most promising bound
+        candidates = []
         for zone_map in self.column_store.get_zone_maps()[column_name]:
             min_idx, max_idx = \
                 zone_map.get_zone_map()['min_idx'], zone_map.get_zone_map()[
                     'max_idx']
             if min_idx <= end and start <= max_idx:
-                print(
-                    f"Found the zone containing the indexes: {zone_map.get_zone_count()}")
-                # Process the split files within the target zone
-                zone_indexes = self.get_zone_indexes(indexes, min_idx, max_idx)
-                if len(zone_indexes) == 0:
-                    continue
-                print("Range of indexes:", min(
-                    zone_indexes), max(zone_indexes))
+                indexes_in_zone = self.get_zone_indexes(
+                    indexes, min_idx, max_idx)
+                if len(indexes_in_zone) > 0:
+                    min_value, max_value = zone_map.get_value_range()
+                    bound = make_key(
+                        max_value if descending else min_value)
+                    candidates.append(
+                        (bound, zone_map.get_zone_count(), min_idx, indexes_in_zone))
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+        # a zone can only be skipped once the heap holds k values, so only the zones reached before that are
+        # prefetched, and the rest are read after passing the bound check
+        num_prefetched, num_selected = 0, 0
+        while num_prefetched < len(candidates) and num_selected < k:
+            num_selected += len(candidates[num_prefetched][3])
+            num_prefetched += 1
+
+        top = []  # min-heap of the best (key, index) pairs so far
+        zones = self.read_zones(
+            column_name, [zone_count for _, zone_count, _, _ in candidates[:num_prefetched]])
+        for position, (bound, zone_count, min_idx, indexes_in_zone) in enumerate(candidates if k > 0 else []):
+            # the remaining zones are sorted by bound, so none of them can beat the k-th value either
+            if len(top) == k and bound <= top[0][0]:
+                print(f"Skipped the remaining zones from zone {zone_count}")
+                break
+
+            if position < num_prefetched:
+                _, lines = next(zones)
+            else:
+                lines = read_chunk(
+                    self.column_store.get_chunk_path(column_name, zone_count))
+            print(f"Found the zone containing the indexes: {zone_count}")
+            self.zones_read.setdefault(
+                (self.column_store.name, column_name), set()).add(zone_count)
+
+            zone_top = heapq.nlargest(k, ((make_key(parse_column_value(column_name, lines[index - min_idx])), index)
+                                          for index in indexes_in_zone))
+            for item in zone_top:
+                if len(top) < k:
+                    heapq.heappush(top, item)
+                elif item > top[0]:
+                    heapq.heapreplace(top, item)
+                else:
+                    break
+
+        top = sorted(top, reverse=True)
+        values = [key if descending else key.value for key, _ in top]
+        indexes = [index for _, index in top]
+
+        # the indexes of a projection are positions in its sort order, map them back to the base row indexes
+        if self.column_store is not self.base_store:
+            indexes = self.read_values(
+                self.column_store, ROW_ID_COLUMN, indexes)
+
+        return list(zip(values, indexes))
+
+    def fetch_columns(self, indexes: list[int], column_names: List[str]) -> Dict[str, list]:
+        """
+        Fetches the values of other columns at the given row indexes, e.g. those returned by process_top_k.
 
-                self.process_split_files(
-                    column_name, zone_map.get_zone_count(), None, None, zone_indexes, True)
+        Args:
+            indexes (list[int]): The row indexes in the base column store.
+            column_names (List[str]): The column names to fetch.
 
-        # self.debug_output_data()
+        Returns:
+            Dict[str, list]: The values of each column, in the order of indexes.
+        """
+        return {column_name: self.read_values(self.base_store, column_name, indexes)
+                for column_name in column_names}
 
-        output = self.calc_stat(interested_stat)
+    def read_values(self, column_store: ColumnStore, column_name: str, indexes: list[int]) -> list:
+        """
+        Reads the values of a column at the given row indexes of a column store or projection.
 
-        # reset data buffer
-        self.data = []
+        Args:
+            column_store (ColumnStore): The column store or projection to read from.
+            column_name (str): The column name.
+            indexes (list[int]): The row indexes in column_store.
+
+        Returns:
+            list: The values, in the order of indexes.
+        """
+        zone_maps = column_store.get_zone_maps()[column_name]
+        min_idxs = [zone_map.get_zone_map()['min_idx']
+                    for zone_map in zone_maps]
+
+        # group the indexes by the zone holding them, so that each split file is read once
+        zone_indexes = {}
+        for index in indexes:
+            zone_count = zone_maps[bisect.bisect_right(
+                min_idxs, index) - 1].get_zone_count()
+            zone_indexes.setdefault(zone_count, []).append(index)
+
+        values = {}
+        for zone_count, lines in self.read_zones(column_name, sorted(zone_indexes), column_store):
+            for index in zone_indexes[zone_count]:
+                values[index] = parse_column_value(
+                    column_name, lines[index - min_idxs[zone_count]])
+        return [values[index] for index in indexes]
+
+    def execute(self, column_name: ColumnsOfInterest, interested_stat: int):
+        """
+        Runs the month, town and query stages, serving repeated queries from the column store's query cache.
+
+        The stages run against the projection and in the order chosen by ColumnStore.plan_query.
+
+        Args:
+            column_name (ColumnsOfInterest): The column name of interest.
+            interested_stat (int): The statistic to calculate.
+
+        Returns:
+            list: The query result as returned by calc_stat.
+        """
+        window = self.get_month_window()
+        key = (window, self.town, interested_stat)
+        output = self.query_cache.results.get(key)
+        if output is not None:
+            print("Found the query result in the cache")
+            return output
+
+        source_column = self.process_predicates(column_name)
+        output = self.process_query(
+            column_name, interested_stat, source_column=source_column)
+
+        self.query_cache.results.put(
+            key, output, self.zones_read, self.get_predicates())
         return output
 
+    def execute_top_k(self, column_name: ColumnsOfInterest, k: int, descending: bool = True):
+        """
+        Runs the month and town stages, then finds the k rows with the largest or smallest values of a column.
+
+        Args:
+            column_name (ColumnsOfInterest): The column name to order by.
+            k (int): The number of rows to return.
+            descending (bool, optional): Orders from the largest value if True. Defaults to True.
+
+        Returns:
+            list: The (value, index) pairs as returned by process_top_k.
+        """
+        source_column = self.process_predicates(column_name)
+        return self.process_top_k(column_name, k, source_column, descending)
+
+    def process_predicates(self, column_name: ColumnsOfInterest) -> str:
+        """
+        Plans the query with ColumnStore.plan_query and runs its month and town stages in the chosen order.
+
+        Args:
+            column_name (ColumnsOfInterest): The column name of interest.
+
+        Returns:
+            str: The column of the last stage, holding the selected indexes.
+        """
+        predicates = self.get_predicates()
+        self.column_store, order = self.column_store.plan_query(
+            predicates, column_name)
+        print(f"Query plan: {self.column_store.name} -> {' -> '.join(order)}")
+
+        self.process_scan(order[0], *predicates[order[0]])
+        for source_column, filter_column in zip(order, order[1:]):
+            self.process_filter(
+                filter_column, *predicates[filter_column], source_column)
+        return order[-1]
+
+    def get_predicates(self) -> Dict[str, tuple]:
+        """
+        Returns the (start, end) range the query filters each column on.
+
+        Returns:
+            Dict[str, tuple]: The ranges of the month and town columns.
+        """
+        return {'month': self.get_month_window(), 'town': (self.town, self.town)}
+
+    def get_month_window(self):
+        """
+        Returns the first and last month of the query.
+
+        Returns:
+            tuple: The start and end values in the format of the month column.
+        """
+        return f"{self.year}-{self.month:02}", f"{self.year}-{(self.month + 2) % 12:02}"
+
+    def read_buffer_indexes(self, column_name: ColumnsOfInterest):
+        """
+        Reads the indexes selected by a stage from its temp files and resets the buffer folder count.
+
+        Args:
+            column_name (ColumnsOfInterest): The column name of the stage.
+
+        Returns:
+            tuple: The list of indexes, and the smallest and largest index.
+        """
+        if column_name in self.selections:
+            indexes = self.selections.pop(column_name)
+            if not indexes:
+                return indexes, float('inf'), float('-inf')
+            return indexes, indexes[0], indexes[-1]
+
+        indexes = []
+        start, end = float('inf'), float('-inf')
+        for i in range(self.num_buffer_folders + 1):
+            temp_file_path = os.path.join(
+                self.buffer_folder, f"{column_name}_chunk_{i}.txt")
+
+            if not os.path.exists(temp_file_path):
+                print(f"Error: {temp_file_path} not found.")
+                continue
+
+            with open(temp_file_path, 'r', encoding='utf-8') as temp_file:
+                indexes += [int(line.rsplit(" ", 1)[1])
+                            for line in temp_file]
+                start = min(start, indexes[0])
+                end = max(end, indexes[-1])
+
+        # Reset the buffer folder count
+        self.num_buffer_folders = 0
+        return indexes, start, end
+
     def debug_output_data(self):
         """
         Write the data to a file for debugging purposes.
@@ -400,13 +1021,33 @@ class QueryProcessor:
         """
         Resets the global variables of the class.
 
-        This method sets the `lines_processed` variable to 0 and closes the `temp_output_file` if it is open.
+        This method sets the `lines_processed` variable to 0, clears the indexes selected by the stage and closes
+        the `temp_output_file` if it is open.
         """
         self.lines_processed = 0
+        self.selected_indexes = []
         if self.temp_output_file:
             self.temp_output_file.close()
         self.temp_output_file = None
 
+    def read_zones(self, column_name: str, zone_counts: list, column_store: ColumnStore = None):
+        """
+        Reads the split files of the given zones, prefetching the next zones while the current one is processed.
+
+        Args:
+            column_name (str): The column name.
+            zone_counts (list): The zone counts, in the order they will be processed.
+            column_store (ColumnStore, optional): The column store or projection to read from. Defaults to the one
+                the query runs on.
+
+        Returns:
+            iterator: The zone count and the lines of the split file of each zone.
+        """
+        column_store = column_store or self.column_store
+        file_paths = [column_store.get_chunk_path(
+            column_name, zone_count) for zone_count in zone_counts]
+        return zip(zone_counts, self.prefetcher.read(file_paths))
+
     def get_zone_indexes(self, indexes: list[int], min_idx: int, max_idx: int) -> list[int]:
         """
         Returns a list of indexes from the given list that fall within the specified range.
@@ -421,80 +1062,92 @@ class QueryProcessor:
         """
         return [idx for idx in indexes if min_idx <= idx <= max_idx]
 
-    def process_split_files(self, column_name: str, zone_count: int, start: str, end: str, indexes: list = [], final: bool = False):
+    def process_split_files(self, column_name: str, zone_count: int, start, end, indexes: list = [], final: bool = False, lines: list = None):
         """
         Processes the split files.
 
         Args:
             column_name (str): The column name.
             zone_count (int): The zone count.
-            start (str): The start value.
-            end (str): The end value.
+            start: The inclusive lower bound of the column value.
+            end: The inclusive upper bound of the column value.
             indexes (list, optional): The list of indexes. Defaults to [].
             final (bool, optional): Indicates if it's the final processing. Defaults to False.
+            lines (list, optional): The lines of the split file if it was already read. Defaults to None.
         """
-        directory = self.column_store.disk_folder
-        file_path = os.path.join(
-            directory, f"{column_name}_chunk_{zone_count}.txt")
-        lower_bound = zone_count * self.max_file_lines
-
-        # Sequential scan
-        with open(file_path, 'r', encoding='utf-8') as file:
-            if indexes:
-                content = file.readlines()
-                for index in indexes:
-                    # Seek to the index positions
-                    offset = index - zone_count * self.max_file_lines
-                    # Process the lines from the index positions
-                    # Don't -1 because index is already 0-based when reading from month file
-                    line = content[offset]
-                    value = line.rstrip()
-
-                    if final:
-                        self.data.append(int(value))
-                        continue
+        if lines is None:
+            lines = read_chunk(
+                self.column_store.get_chunk_path(column_name, zone_count))
+        lower_bound = self.column_store.get_zone_maps()[column_name][zone_count].get_zone_map()[
+            'min_idx']
+        self.zones_read.setdefault(
+            (self.column_store.name, column_name), set()).add(zone_count)
+
+        if indexes:
+            for index in indexes:
+                # Seek to the index positions
+                offset = index - lower_bound
+                # Process the lines from the index positions
+                # Don't -1 because index is already 0-based when reading from month file
+                value = lines[offset].rstrip()
+
+                if final:
+                    self.data.append(int(value))
+                    continue
 
-                    if start <= value <= end:
-                        # If lines_processed reaches MAX_FILE_LINES, close the current temporary file
-                        if self.lines_processed % self.max_file_lines == 0:
-                            if self.temp_output_file:
-                                self.temp_output_file.close()
-
-                            # Create a new temporary file
-                            temp_output_file_path = os.path.join(
-                                self.buffer_folder, f"{column_name}_chunk_{self.lines_processed // self.max_file_lines}.txt")
-                            self.temp_output_file = open(
-                                temp_output_file_path, 'w', encoding='utf-8')
-
-                        # Write the line to the current temporary file
-                        self.temp_output_file.write(
-                            f"{value} {index}\n")
-                        self.lines_processed += 1
-            else:
-                # Process the lines sequentially
-                for offset, line in enumerate(file):
-                    value = line.rstrip()
-
-                    if start <= value <= end:
-                        # If lines_processed reaches MAX_FILE_LINES, close the current temporary file
-                        if self.lines_processed % self.max_file_lines == 0:
-                            if self.temp_output_file:
-                                self.temp_output_file.close()
-
-                            # Create a new temporary file
-                            temp_output_file_path = os.path.join(
-                                self.buffer_folder, f"{column_name}_chunk_{self.lines_processed // self.max_file_lines}.txt")
-                            self.temp_output_file = open(
-                                temp_output_file_path, 'w', encoding='utf-8')
-
-                        # Write the line to the current temporary file
-                        self.temp_output_file.write(
-                            f"{value} {lower_bound + offset}\n")
-                        self.lines_processed += 1
+                if start <= parse_column_value(column_name, value) <= end:
+                    self.write_selected(column_name, value, index)
+        else:
+            # Process the lines sequentially
+            for offset, line in enumerate(lines):
+                value = line.rstrip()
+
+                if start <= parse_column_value(column_name, value) <= end:
+                    self.write_selected(
+                        column_name, value, lower_bound + offset)
 
         self.num_buffer_folders = max(
             self.num_buffer_folders, self.lines_processed // self.max_file_lines)
 
+    def write_selected(self, column_name: str, value: str, index: int):
+        """
+        Writes a selected value and its index to the temp files of the stage.
+
+        Args:
+            column_name (str): The column name.
+            value (str): The raw value.
+            index (int): The row index of the value.
+        """
+        # If lines_processed reaches MAX_FILE_LINES, close the current temporary file
+        if self.lines_processed % self.max_file_lines == 0:
+            if self.temp_output_file:
+                self.temp_output_file.close()
+
+            # Create a new temporary file
+            temp_output_file_path = os.path.join(
+                self.buffer_folder, f"{column_name}_chunk_{self.lines_processed // self.max_file_lines}.txt")
+            self.temp_output_file = open(
+                temp_output_file_path, 'w', encoding='utf-8')
+
+        # Write the line to the current temporary file
+        self.temp_output_file.write(f"{value} {index}\n")
+        self.selected_indexes.append(index)
+        self.lines_processed += 1
+
+
+def parse_column_value(column_name: str, value):
+    """
+    Converts a raw column value to the type it is compared as.
+
+    Args:
+        column_name (str): The column name.
+        value: The raw value.
+
+    Returns:
+        The value converted according to COLUMN_TYPES, or the value as a string.
+    """
+    return COLUMN_TYPES.get(column_name, str)(value)
+
 
 def create_directory_if_not_exists(directory):
     if not os.path.exists(directory):
@@ -568,9 +1221,7 @@ def run(column_store: ColumnStore, max_file_lines=MAX_FILE_LINES):
         start = time.time()
         processor = QueryProcessor(
             year, month, town, column_store, max_file_lines=max_file_lines)
-        processor.process_year_and_month()
-        processor.process_towns()
-        data = processor.process_query(interested_column, interested_stat)
+        data = processor.execute(interested_column, interested_stat)
         end = time.time()
         time_taken = end - start
         print(f"\nQuery time: {time_taken}s")
@@ -583,12 +1234,12 @@ def run(column_store: ColumnStore, max_file_lines=MAX_FILE_LINES):
         delete_all_files_in_directory(BUFFER_FOLDER)
 
 
-def main(max_file_lines=MAX_FILE_LINES):
+def main(max_file_lines=MAX_FILE_LINES, zone_sizes: Dict[str, int] = None):
     columns_of_interest = [ColumnsOfInterest.TOWN.value, ColumnsOfInterest.MONTH.value,
                            ColumnsOfInterest.FLOOR_AREA_SQM.value, ColumnsOfInterest.RESALE_PRICE.value]
 
     column_store = ColumnStore(
-        INPUT_PATH, DISK_FOLDER, columns_of_interest, max_file_lines)
+        INPUT_PATH, DISK_FOLDER, columns_of_interest, max_file_lines, zone_sizes, PROJECTIONS)
     column_store.process_csv()
 
     # zone_maps = column_store.get_zone_maps()
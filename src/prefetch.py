@@ -0,0 +1,62 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from constants import PREFETCH_DEPTH, PREFETCH_WORKERS
+
+
+def read_chunk(file_path: str) -> list:
+    """
+    Reads and decodes a chunk file.
+
+    Args:
+        file_path (str): The path of the chunk file.
+
+    Returns:
+        list: The lines of the chunk file without line endings.
+    """
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return file.read().splitlines()
+
+
+class ZonePrefetcher:
+    def __init__(self, depth: int = PREFETCH_DEPTH, workers: int = PREFETCH_WORKERS):
+        """
+        Initializes a ZonePrefetcher object.
+
+        Args:
+            depth (int, optional): The number of chunk files read ahead of the one being processed. 0 reads
+                every chunk file only when it is needed. Defaults to PREFETCH_DEPTH.
+            workers (int, optional): The number of threads reading chunk files. Defaults to PREFETCH_WORKERS.
+        """
+        self.depth = depth
+        self.workers = workers
+
+    def read(self, file_paths: list):
+        """
+        Reads chunk files in the background, keeping up to depth reads in flight ahead of the consumer.
+
+        Args:
+            file_paths (list): The paths of the chunk files, in the order they will be processed.
+
+        Yields:
+            list: The lines of each chunk file, in the order of file_paths.
+        """
+        if self.depth <= 0 or len(file_paths) <= 1:
+            for file_path in file_paths:
+                yield read_chunk(file_path)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            remaining = iter(file_paths)
+            for file_path in remaining:
+                pending.append(executor.submit(read_chunk, file_path))
+                if len(pending) >= self.depth:
+                    break
+
+            while pending:
+                lines = pending.popleft().result()
+                # issue the next read before handing the current zone over
+                for file_path in remaining:
+                    pending.append(executor.submit(read_chunk, file_path))
+                    break
+                yield lines
@@ -0,0 +1,100 @@
+import os
+import random
+import time
+import contextlib
+from typing import Dict, List
+from cache import QueryCache
+from constants import *
+from main import ColumnStore, ColumnsOfInterest, QueryProcessor, delete_all_files_in_directory
+
+
+def sample_workload(size: int = TUNER_WORKLOAD_SIZE, seed: int = None) -> list:
+    """
+    Samples queries from the space of queries a matriculation number can encode.
+
+    Args:
+        size (int, optional): The number of queries. Defaults to TUNER_WORKLOAD_SIZE.
+        seed (int, optional): The random seed. Defaults to None.
+
+    Returns:
+        list: A list of (year, month, town, statistic) tuples.
+    """
+    rng = random.Random(seed)
+    return [(rng.randint(2014, 2023), rng.randint(1, 9), rng.choice(list(TOWN_MAPPING.values())), rng.choice(list(STATISTIC_TYPE)))
+            for _ in range(size)]
+
+
+class ZoneSizeTuner:
+    def __init__(self, column_store: ColumnStore, workload: list, candidate_sizes: List[int] = ZONE_SIZE_CANDIDATES, repeats: int = TUNER_REPEATS):
+        """
+        Initializes a ZoneSizeTuner object.
+
+        Args:
+            column_store (ColumnStore): The column store to tune, already processed.
+            workload (list): A list of (year, month, town, statistic) queries, e.g. from sample_workload.
+            candidate_sizes (List[int], optional): The zone sizes to try. Defaults to ZONE_SIZE_CANDIDATES.
+            repeats (int, optional): The number of times the workload is timed per zone size. Defaults to TUNER_REPEATS.
+        """
+        self.column_store = column_store
+        self.workload = workload
+        self.candidate_sizes = candidate_sizes
+        self.repeats = repeats
+        self.results: Dict[str, Dict[int, float]] = {}
+
+    def measure(self) -> float:
+        """
+        Times the workload against the column store.
+
+        Returns:
+            float: The fastest of the repeated workload times in seconds.
+        """
+        best = float('inf')
+        for _ in range(self.repeats):
+            start = time.perf_counter()
+            for year, month, town, interested_stat in self.workload:
+                interested_column = ColumnsOfInterest.FLOOR_AREA_SQM.value if interested_stat < 4 else ColumnsOfInterest.RESALE_PRICE.value
+                processor = QueryProcessor(
+                    year, month, town, self.column_store, max_file_lines=self.column_store.max_file_lines)
+                processor.execute(interested_column, interested_stat)
+                delete_all_files_in_directory(processor.buffer_folder)
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    def tune(self, columns: List[str] = None) -> Dict[str, int]:
+        """
+        Picks the zone size of each column that minimizes the measured workload latency.
+
+        The columns are tuned one at a time, keeping the best size found for each column before moving to the next.
+        Each size is applied to the column store and its projections alike, since the planner may route a query
+        to either. The query cache is disabled while tuning so that every query reads its zones.
+
+        Args:
+            columns (List[str], optional): The columns to tune. Defaults to the columns read by the workload.
+
+        Returns:
+            Dict[str, int]: The chosen zone size of each tuned column.
+        """
+        if columns is None:
+            columns = [ColumnsOfInterest.MONTH.value, ColumnsOfInterest.TOWN.value,
+                       ColumnsOfInterest.FLOOR_AREA_SQM.value, ColumnsOfInterest.RESALE_PRICE.value]
+
+        query_cache = self.column_store.query_cache
+        self.column_store.query_cache = QueryCache(0, 0)
+        try:
+            # the pipeline prints every zone it reads, keep that out of the timings
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                for column_name in columns:
+                    self.results[column_name] = {}
+                    for zone_size in self.candidate_sizes:
+                        self.column_store.set_zone_size(column_name, zone_size)
+                        self.results[column_name][zone_size] = self.measure()
+
+                    best_size = min(
+                        self.results[column_name], key=self.results[column_name].get)
+                    self.column_store.set_zone_size(column_name, best_size)
+        finally:
+            self.column_store.query_cache = query_cache
+
+        # the zones were rewritten while the query cache was swapped out
+        query_cache.clear()
+        return {column_name: self.column_store.get_zone_size(column_name) for column_name in columns}
@@ -0,0 +1,39 @@
+import argparse
+import sys
+import os
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../src')))
+
+
+def auto_chunk_size():
+    from main import ColumnStore, ColumnsOfInterest
+    from tuner import ZoneSizeTuner, sample_workload
+    from constants import INPUT_PATH, DISK_FOLDER, MAX_FILE_LINES, PROJECTIONS, TUNER_WORKLOAD_SIZE
+
+    # Get args from command line
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workload_size", type=int,
+                        default=TUNER_WORKLOAD_SIZE)
+    parser.add_argument("--seed", type=int, default=None)
+
+    args = parser.parse_args()
+    columns_of_interest = [ColumnsOfInterest.TOWN.value, ColumnsOfInterest.MONTH.value,
+                           ColumnsOfInterest.FLOOR_AREA_SQM.value, ColumnsOfInterest.RESALE_PRICE.value]
+    # build the same projections as main() so that the planner routes queries as it does there
+    column_store = ColumnStore(
+        INPUT_PATH, DISK_FOLDER, columns_of_interest, MAX_FILE_LINES, projections=PROJECTIONS)
+    column_store.process_csv()
+
+    tuner = ZoneSizeTuner(column_store, sample_workload(
+        args.workload_size, args.seed))
+    zone_sizes = tuner.tune()
+
+    for column_name, timings in tuner.results.items():
+        print(f"{column_name}:")
+        for zone_size, query_time in timings.items():
+            print(f"\t{zone_size}: {query_time}s")
+    print(f'Optimal zone sizes: {zone_sizes}')
+
+
+if __name__ == "__main__":
+    auto_chunk_size()